@@ -1,8 +1,11 @@
+import json
 import sqlite3
+from collections import defaultdict
 from pathlib import Path
+from typing import Optional
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import streamlit as st
 
 DB_PATH = Path("cell_counts.db")
@@ -12,116 +15,342 @@ TEIKO_RED = "#FF4B4B"        # bright red
 TEIKO_NAVY = "#050816"       # dark navy background
 TEIKO_NAVY_SOFT = "#111827"  # soft dark navy for contrast
 
+# Response values drawn in the accent color ("yes" in the trial data,
+# "responder" in the demo database)
+RESPONDER_VALUES = {"yes", "responder"}
 
-@st.cache_data
-def load_data() -> pd.DataFrame:
-    """Load all data from the SQLite database into a DataFrame.
-    If the DB file or table is missing, return an empty DataFrame.
+# Reader-side settings; journal_mode=WAL is set once by init_db.py
+READER_PRAGMAS = """
+PRAGMA query_only=1;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+"""
+
+
+def connect_read_only(path: Path = DB_PATH) -> sqlite3.Connection:
+    """Open the database read-only so dashboard reads never take write locks."""
+    conn = sqlite3.connect(
+        f"{path.resolve().as_uri()}?mode=ro",
+        uri=True,
+        check_same_thread=False,
+    )
+    conn.executescript(READER_PRAGMAS)
+    return conn
+
+
+# Fails if the table is missing and returns nothing if it is empty
+TABLE_EXISTS_SQL = "SELECT 1 FROM cell_counts LIMIT 1"
+
+
+# Low-cardinality text columns held as pandas categoricals (small int codes)
+CATEGORY_COLUMNS = ("condition", "treatment", "sample_type")
+
+
+def _as_categories(df: pd.DataFrame) -> pd.DataFrame:
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def current_db_version() -> Optional[tuple]:
+    """Cache key for the database's current contents, or None if the file is missing."""
+    try:
+        stat = DB_PATH.stat()
+    except FileNotFoundError:
+        return None
+    try:
+        wal = DB_PATH.with_name(DB_PATH.name + "-wal").stat()
+    except FileNotFoundError:
+        wal = None
+    # Reloads commit to the WAL and replacements change the inode; an empty
+    # WAL only means a reader opened the file
+    wal_mtime = wal.st_mtime_ns if wal is not None and wal.st_size else None
+    return stat.st_ino, stat.st_mtime_ns, wal_mtime
+
+
+# max_entries=1: a new database version evicts the previous connection, which
+# is closed once no in-flight query still holds it
+@st.cache_resource(max_entries=1)
+def get_conn(db_version: tuple) -> sqlite3.Connection:
+    """Return one read-only connection per database version, shared by every
+    rerun and session.
     """
-    # If DB file doesn't exist, return empty DataFrame
-    if not DB_PATH.exists():
-        return pd.DataFrame()
+    return connect_read_only()
 
-    conn = sqlite3.connect(DB_PATH)
+
+@st.cache_resource(max_entries=1)
+def _table_exists(db_version: tuple) -> bool:
+    """Whether cell_counts exists and has rows, checked once per database
+    version rather than per rerun.
+    """
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='cell_counts'"
-        )
-        if cur.fetchone() is None:
-            # table not found
-            return pd.DataFrame()
-        df = pd.read_sql_query("SELECT * FROM cell_counts", conn)
-    except Exception:
-        # Any DB error -> return empty DataFrame to let main() handle messaging
-        return pd.DataFrame()
-    finally:
-        conn.close()
-    return df
+        return get_conn(db_version).execute(TABLE_EXISTS_SQL).fetchone() is not None
+    except sqlite3.Error:
+        return False
 
 
-def set_page_style() -> None:
-    st.set_page_config(
-        page_title="Teiko-style Immune Dashboard",
-        layout="wide",
+# Columns the dashboard reads, and the integer ones among them
+DASHBOARD_COLUMNS = (
+    "project",
+    "subject",
+    "sample",
+    "condition",
+    "treatment",
+    "response",
+    "sample_type",
+    "time_from_treatment_start",
+    "b_cell",
+)
+INT32_COLUMNS = {"time_from_treatment_start": "int32", "b_cell": "int32"}
+SELECT_SQL = f"SELECT {', '.join(DASHBOARD_COLUMNS)} FROM cell_counts"
+
+
+def _read_frame(db_version: tuple, sql: str, params=()) -> pd.DataFrame:
+    """Run a query on the shared connection and build a typed DataFrame
+    directly from the fetched tuples.
+    """
+    cur = get_conn(db_version).execute(sql, params)
+    cols = [d[0] for d in cur.description]
+    df = pd.DataFrame.from_records(cur.fetchall(), columns=cols)
+    df = df.astype({c: t for c, t in INT32_COLUMNS.items() if c in df})
+    return _as_categories(df)
+
+
+# Sidebar filter key -> cell_counts column, as stored in cell_counts_meta
+FILTER_COLUMNS = {
+    "conditions": "condition",
+    "treatments": "treatment",
+    "sample_types": "sample_type",
+    "timepoints": "time_from_treatment_start",
+}
+
+
+@st.cache_data
+def filter_options(db_version: tuple) -> dict:
+    """Sorted distinct values for each sidebar filter, computed once per load.
+    Read from the cell_counts_meta table written by init_db.py when present.
+    """
+    conn = get_conn(db_version)
+    try:
+        rows = conn.execute("SELECT key, value FROM cell_counts_meta").fetchall()
+    except sqlite3.Error:
+        # Demo or older databases have no meta table
+        rows = []
+    if rows:
+        return {key: json.loads(value) for key, value in rows}
+
+    return {
+        key: [
+            value
+            for (value,) in conn.execute(
+                f"SELECT DISTINCT {col} FROM cell_counts WHERE {col} IS NOT NULL ORDER BY {col}"
+            )
+        ]
+        for key, col in FILTER_COLUMNS.items()
+    }
+
+
+# Rows shown in the sample overview table
+OVERVIEW_ROWS = 20
+
+
+def _placeholders(values) -> str:
+    return ",".join("?" * len(values))
+
+
+@st.cache_data
+def query_filtered(
+    db_version: tuple,
+    conditions: tuple,
+    treatments: tuple,
+    sample_types: tuple,
+    timepoints: tuple,
+    limit: Optional[int] = None,
+) -> pd.DataFrame:
+    """Fetch only the rows matching the sidebar selection, in insertion order.
+    An empty timepoint selection means "all timepoints".
+    """
+    sql = (
+        SELECT_SQL
+        + f" WHERE condition IN ({_placeholders(conditions)})"
+        f" AND treatment IN ({_placeholders(treatments)})"
+        f" AND sample_type IN ({_placeholders(sample_types)})"
     )
-    st.markdown(
-        f"""
-        <style>
-            body {{
-                background-color: {TEIKO_NAVY};
-                color: #FFFFFF;
-            }}
-            .stApp {{
-                background-color: {TEIKO_NAVY};
-                color: #FFFFFF;
-            }}
-            h1, h2, h3, h4, h5, h6 {{
-                color: #FFFFFF;
-            }}
-            .css-18e3th9, .css-1d391kg {{
-                background-color: {TEIKO_NAVY_SOFT};
-            }}
-        </style>
-        """,
-        unsafe_allow_html=True,
+    params = list(conditions) + list(treatments) + list(sample_types)
+    if timepoints:
+        sql += f" AND time_from_treatment_start IN ({_placeholders(timepoints)})"
+        params += list(timepoints)
+    sql += " ORDER BY rowid"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return _read_frame(db_version, sql, params)
+
+
+BOX_GROUP_KEYS = ["time_from_treatment_start", "response"]
+
+# Above this many PBMC values, outliers are subsampled before rendering
+LARGE_PLOT_ROWS = 10_000
+OUTLIERS_PER_GROUP = 200
+
+
+def _pbmc_b_cell_groups(
+    db_version: tuple, conditions: tuple, treatments: tuple, timepoints: tuple
+) -> dict:
+    """PBMC b_cell values per (timepoint, response) for the sidebar selection.
+    Read from the packed uint32 blobs in b_cell_buckets, or from cell_counts
+    rows for demo and older databases without that table.
+    """
+    where = (
+        " WHERE sample_type = 'PBMC'"
+        f" AND condition IN ({_placeholders(conditions)})"
+        f" AND treatment IN ({_placeholders(treatments)})"
+    )
+    params = list(conditions) + list(treatments)
+    if timepoints:
+        where += f" AND time_from_treatment_start IN ({_placeholders(timepoints)})"
+        params += list(timepoints)
+
+    groups = defaultdict(list)
+    conn = get_conn(db_version)
+    try:
+        rows = conn.execute(
+            "SELECT time_from_treatment_start, response, vals FROM b_cell_buckets" + where,
+            params,
+        ).fetchall()
+    except sqlite3.Error:
+        rows = conn.execute(
+            "SELECT time_from_treatment_start, response, b_cell FROM cell_counts" + where,
+            params,
+        ).fetchall()
+        for timepoint, response, b_cell in rows:
+            groups[(timepoint, response)].append(b_cell)
+        arrays = {key: np.array(vals, dtype=np.uint32) for key, vals in groups.items()}
+    else:
+        for timepoint, response, blob in rows:
+            groups[(timepoint, response)].append(np.frombuffer(blob, dtype="<u4"))
+        arrays = {key: np.concatenate(parts) for key, parts in groups.items()}
+    # Samples without a recorded response are not plotted
+    return {key: vals for key, vals in arrays.items() if key[1] is not None}
+
+
+@st.cache_data
+def box_summary(
+    db_version: tuple,
+    conditions: tuple,
+    treatments: tuple,
+    timepoints: tuple,
+    tukey_fences: bool = False,
+) -> tuple:
+    """Per-(timepoint, response) box stats and outliers for PBMC B cell counts."""
+    groups = _pbmc_b_cell_groups(db_version, conditions, treatments, timepoints)
+    total = sum(len(vals) for vals in groups.values())
+    rng = np.random.default_rng(0)
+
+    stats, outliers = [], []
+    for (timepoint, response), vals in sorted(groups.items()):
+        q1, median, q3 = np.percentile(vals, [25, 50, 75])
+        inside = vals
+        if tukey_fences:
+            iqr = q3 - q1
+            in_fence = (vals >= q1 - 1.5 * iqr) & (vals <= q3 + 1.5 * iqr)
+            inside, outside = vals[in_fence], vals[~in_fence]
+            if total > LARGE_PLOT_ROWS and len(outside) > OUTLIERS_PER_GROUP:
+                outside = rng.choice(outside, OUTLIERS_PER_GROUP, replace=False)
+            outliers += [(timepoint, response, int(v)) for v in outside]
+        stats.append((timepoint, response, q1, median, q3, inside.min(), inside.max()))
+
+    return (
+        pd.DataFrame.from_records(
+            stats, columns=BOX_GROUP_KEYS + ["25%", "50%", "75%", "min", "max"]
+        ),
+        pd.DataFrame.from_records(outliers, columns=BOX_GROUP_KEYS + ["b_cell"]),
     )
 
 
+def _response_offsets(timepoints, responses) -> tuple:
+    """Per-response x offsets and box width for side-by-side boxes on the
+    numeric day axis. Outlier points reuse the same offsets, which plotly's
+    boxmode="group" cannot provide for scatter traces.
+    """
+    days = sorted(set(timepoints))
+    spacing = min((b - a for a, b in zip(days, days[1:])), default=1)
+    slot = 0.8 * spacing / max(len(responses), 1)
+    offsets = {
+        resp: (i - (len(responses) - 1) / 2) * slot
+        for i, resp in enumerate(responses)
+    }
+    return offsets, 0.8 * slot
+
+
+# Built once at import; the palette is constant
+_STYLE = f"""
+<style>
+    body {{
+        background-color: {TEIKO_NAVY};
+        color: #FFFFFF;
+    }}
+    .stApp {{
+        background-color: {TEIKO_NAVY};
+        color: #FFFFFF;
+    }}
+    h1, h2, h3, h4, h5, h6 {{
+        color: #FFFFFF;
+    }}
+    .css-18e3th9, .css-1d391kg {{
+        background-color: {TEIKO_NAVY_SOFT};
+    }}
+</style>
+"""
+
+
+def set_page_style() -> None:
+    if "_cfg" not in st.session_state:
+        st.set_page_config(
+            page_title="Teiko-style Immune Dashboard",
+            layout="wide",
+        )
+        st.session_state["_cfg"] = True
+    # The style element must be emitted every run or Streamlit drops it
+    st.markdown(_STYLE, unsafe_allow_html=True)
+
+
+# Demo rows in DASHBOARD_COLUMNS order
+_SAMPLE_ROWS = [
+    ("P1", "S1", "SM1", "healthy", "A", "responder", "PBMC", 0, 100),
+    ("P1", "S1", "SM2", "healthy", "A", "non-responder", "PBMC", 7, 80),
+    ("P1", "S2", "SM3", "disease", "B", "responder", "PBMC", 14, 150),
+    ("P2", "S3", "SM4", "disease", "B", "non-responder", "tissue", 7, 60),
+]
+
+_SAMPLE_SCHEMA_SQL = """
+CREATE TABLE cell_counts (
+    project TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    treatment TEXT NOT NULL,
+    response TEXT,
+    sample_type TEXT NOT NULL,
+    time_from_treatment_start INTEGER NOT NULL,
+    b_cell INTEGER NOT NULL
+);
+"""
+
+
 def create_sample_db(path: Path = DB_PATH) -> None:
     """Create a small sample cell_counts.db with a cell_counts table for demo/testing."""
-    import sqlite3
-    sample = pd.DataFrame(
-        [
-            {
-                "project": "P1",
-                "subject": "S1",
-                "sample": "SM1",
-                "condition": "healthy",
-                "treatment": "A",
-                "response": "responder",
-                "sample_type": "PBMC",
-                "time_from_treatment_start": 0,
-                "b_cell": 100,
-            },
-            {
-                "project": "P1",
-                "subject": "S1",
-                "sample": "SM2",
-                "condition": "healthy",
-                "treatment": "A",
-                "response": "non-responder",
-                "sample_type": "PBMC",
-                "time_from_treatment_start": 7,
-                "b_cell": 80,
-            },
-            {
-                "project": "P1",
-                "subject": "S2",
-                "sample": "SM3",
-                "condition": "disease",
-                "treatment": "B",
-                "response": "responder",
-                "sample_type": "PBMC",
-                "time_from_treatment_start": 14,
-                "b_cell": 150,
-            },
-            {
-                "project": "P2",
-                "subject": "S3",
-                "sample": "SM4",
-                "condition": "disease",
-                "treatment": "B",
-                "response": "non-responder",
-                "sample_type": "tissue",
-                "time_from_treatment_start": 7,
-                "b_cell": 60,
-            },
-        ]
-    )
     conn = sqlite3.connect(path)
     try:
-        sample.to_sql("cell_counts", conn, index=False, if_exists="replace")
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS cell_counts;")
+            conn.execute(_SAMPLE_SCHEMA_SQL)
+            conn.executemany(
+                f"INSERT INTO cell_counts ({', '.join(DASHBOARD_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(DASHBOARD_COLUMNS))});",
+                _SAMPLE_ROWS,
+            )
     finally:
         conn.close()
 
@@ -130,22 +359,28 @@ def main() -> None:
     set_page_style()
     st.title("Immune Cell Population Dashboard")
 
-    df = load_data()
+    version = current_db_version()
 
     # If no data (missing DB/file/table or error), show message and allow creating a demo DB
-    if df.empty:
+    if version is None or not _table_exists(version):
         if not DB_PATH.exists():
-            st.warning(f"Database file not found: {DB_PATH.resolve()}")
-            st.info("You can create a small demo database so the dashboard can run.")
-            if st.button("Create sample database (demo)"):
-                create_sample_db()
-                st.success(f"Created sample database at {DB_PATH.resolve()}. Reloading...")
-                st.experimental_rerun()
-            st.caption(
-                "Or run locally: pip install streamlit pandas plotly && "
-                f"streamlit run {DB_PATH.parent / 'dashboard.py'}"
-            )
-            return
+            # One slot for the whole prompt so it can be cleared after creation
+            prompt = st.empty()
+            with prompt.container():
+                st.warning(f"Database file not found: {DB_PATH.resolve()}")
+                st.info("You can create a small demo database so the dashboard can run.")
+                if not st.button("Create sample database (demo)"):
+                    st.caption(
+                        "Or run locally: pip install streamlit pandas plotly && "
+                        f"streamlit run {DB_PATH.parent / 'dashboard.py'}"
+                    )
+                    return
+            create_sample_db()
+            prompt.empty()
+            # The new file has a new db_version, so cached readers re-fetch in
+            # this run instead of forcing a rerun
+            version = current_db_version()
+            st.success(f"Created sample database at {DB_PATH.resolve()}.")
         else:
             st.error(
                 f"Database table 'cell_counts' not found in {DB_PATH.resolve()}. "
@@ -158,10 +393,11 @@ def main() -> None:
             return
 
     st.sidebar.header("Filters")
-    conditions = sorted(df["condition"].dropna().unique())
-    treatments = sorted(df["treatment"].dropna().unique())
-    sample_types = sorted(df["sample_type"].dropna().unique())
-    timepoints_all = sorted(df["time_from_treatment_start"].dropna().unique())
+    options = filter_options(version)
+    conditions = options["conditions"]
+    treatments = options["treatments"]
+    sample_types = options["sample_types"]
+    timepoints_all = options["timepoints"]
 
     selected_conditions = st.sidebar.multiselect(
         "Condition", conditions, default=conditions
@@ -175,22 +411,23 @@ def main() -> None:
     selected_timepoints = st.sidebar.multiselect(
         "Time from treatment start", timepoints_all
     )
+    show_outliers = st.sidebar.checkbox(
+        "Show outliers (slow for >10k rows)", value=False
+    )
 
-    mask = (
-        df["condition"].isin(selected_conditions)
-        & df["treatment"].isin(selected_treatments)
-        & df["sample_type"].isin(selected_sample_types)
-        & (
-            df["time_from_treatment_start"].isin(selected_timepoints)
-            if selected_timepoints
-            else True
-        )
+    # Only the rows the overview table shows are fetched
+    overview = query_filtered(
+        version,
+        tuple(selected_conditions),
+        tuple(selected_treatments),
+        tuple(selected_sample_types),
+        tuple(selected_timepoints),
+        limit=OVERVIEW_ROWS,
     )
-    filtered = df[mask]
 
     st.subheader("Sample Overview")
     st.write(
-        filtered[
+        overview[
             [
                 "project",
                 "subject",
@@ -201,26 +438,68 @@ def main() -> None:
                 "sample_type",
                 "time_from_treatment_start",
             ]
-        ].head(20)
+        ]
     )
 
     st.subheader("B cell counts over time by response (PBMC)")
-    pbmc = filtered[filtered["sample_type"] == "PBMC"]
-    if not pbmc.empty:
-        fig = px.box(
-            pbmc,
-            x="time_from_treatment_start",
-            y="b_cell",
-            color="response",
-            color_discrete_sequence=[TEIKO_RED, TEIKO_NAVY_SOFT],
-            labels={
-                "time_from_treatment_start": "Days from treatment start",
-                "b_cell": "B cell count",
-                "response": "Response",
-            },
-            title="B cell counts over time (PBMC)",
+    if "PBMC" in selected_sample_types:
+        stats, outliers = box_summary(
+            version,
+            tuple(selected_conditions),
+            tuple(selected_treatments),
+            tuple(selected_timepoints),
+            show_outliers,
         )
+    else:
+        stats = outliers = pd.DataFrame()
+    if not stats.empty:
+        # Deferred so cold starts without a chart (e.g. missing DB) skip plotly
+        import plotly.graph_objects as go
+
+        days = stats["time_from_treatment_start"].tolist()
+        offsets, box_width = _response_offsets(days, stats["response"].unique().tolist())
+        response_colors = {}
+        fig = go.Figure()
+        for resp, group in stats.groupby("response", sort=False):
+            response_colors[resp] = (
+                TEIKO_RED if resp in RESPONDER_VALUES else TEIKO_NAVY_SOFT
+            )
+            fig.add_trace(
+                go.Box(
+                    name=str(resp),
+                    x=group["time_from_treatment_start"].values + offsets[resp],
+                    width=box_width,
+                    hoverinfo="y+name",
+                    q1=group["25%"].values,
+                    median=group["50%"].values,
+                    q3=group["75%"].values,
+                    lowerfence=group["min"].values,
+                    upperfence=group["max"].values,
+                    boxpoints=False,
+                    marker_color=response_colors[resp],
+                )
+            )
+        if not outliers.empty:
+            # WebGL scatter keeps outlier rendering cheap for large selections
+            for resp, group in outliers.groupby("response", sort=False):
+                fig.add_trace(
+                    go.Scattergl(
+                        name=f"{resp} outliers",
+                        x=group["time_from_treatment_start"].values + offsets[resp],
+                        hoverinfo="y+name",
+                        y=group["b_cell"].values,
+                        mode="markers",
+                        marker_color=response_colors.get(resp),
+                        showlegend=False,
+                    )
+                )
         fig.update_layout(
+            boxmode="overlay",
+            title="B cell counts over time (PBMC)",
+            xaxis_title="Days from treatment start",
+            xaxis_tickvals=sorted(set(days)),
+            yaxis_title="B cell count",
+            legend_title_text="Response",
             paper_bgcolor=TEIKO_NAVY_SOFT,
             plot_bgcolor=TEIKO_NAVY_SOFT,
             font_color="#FFFFFF",
@@ -1,7 +1,19 @@
+import json
 import sqlite3
-import csv
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
+# pyarrow's multithreaded CSV reader is used when installed; pandas' C parser
+# otherwise
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    CSV_ENGINE = "c"
+else:
+    CSV_ENGINE = "pyarrow"
+
 
 BASE_DIR = Path(__file__).resolve().parent
 CSV_PATH = BASE_DIR / "cell-count.csv"
@@ -10,7 +22,7 @@ DB_PATH = BASE_DIR / "cell_counts.db"
 
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS cell_counts (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    id INTEGER PRIMARY KEY,
     project TEXT NOT NULL,
     subject TEXT NOT NULL,
     condition TEXT NOT NULL,
@@ -29,6 +41,89 @@ CREATE TABLE IF NOT EXISTS cell_counts (
 );
 """
 
+# Precomputed sorted distinct values for the dashboard's sidebar filters,
+# stored as JSON lists keyed by filter name
+META_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS cell_counts_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+FILTER_META_COLUMNS = {
+    "conditions": "condition",
+    "treatments": "treatment",
+    "sample_types": "sample_type",
+    "timepoints": "time_from_treatment_start",
+}
+
+# b_cell values packed as little-endian uint32 blobs per dashboard filter
+# bucket, so the PBMC box plot can read O(groups) rows instead of O(samples)
+BUCKETS_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS b_cell_buckets (
+    condition TEXT NOT NULL,
+    treatment TEXT NOT NULL,
+    sample_type TEXT NOT NULL,
+    time_from_treatment_start INTEGER NOT NULL,
+    response TEXT,
+    vals BLOB NOT NULL
+);
+"""
+
+BUCKETS_INSERT_SQL = """
+INSERT INTO b_cell_buckets
+SELECT condition, treatment, sample_type, time_from_treatment_start, response,
+       pack_uint32(b_cell)
+FROM cell_counts
+GROUP BY condition, treatment, sample_type, time_from_treatment_start, response;
+"""
+
+# Ingest-time settings. The database stays in WAL mode throughout: leaving WAL
+# needs exclusive access, which fails while the dashboard holds a reader open.
+# synchronous is per-connection, so skipping fsync here does not affect readers.
+BULK_LOAD_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=OFF;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-200000;
+"""
+
+INSERT_COLUMNS = (
+    "project",
+    "subject",
+    "condition",
+    "age",
+    "sex",
+    "treatment",
+    "response",
+    "sample",
+    "sample_type",
+    "time_from_treatment_start",
+    "b_cell",
+    "cd8_t_cell",
+    "cd4_t_cell",
+    "nk_cell",
+    "monocyte",
+)
+
+INSERT_SQL = (
+    f"INSERT INTO cell_counts ({', '.join(INSERT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(INSERT_COLUMNS))});"
+)
+
+
+class UInt32Packer:
+    """SQLite aggregate that packs cell counts into a little-endian uint32 byte string."""
+
+    def __init__(self) -> None:
+        self.values = []
+
+    def step(self, value: int) -> None:
+        self.values.append(value)
+
+    def finalize(self) -> bytes:
+        return np.array(self.values, dtype="<u4").tobytes()
+
 
 def get_connection(db_path: Path) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path)
@@ -38,61 +133,78 @@ def get_connection(db_path: Path) -> sqlite3.Connection:
 
 
 def init_db(conn: sqlite3.Connection) -> None:
-    with conn:
-        conn.execute("DROP TABLE IF EXISTS cell_counts;")
-        conn.execute(SCHEMA_SQL)
+    """Drop and recreate all tables.
+    Runs inside the caller's transaction if one is open; otherwise each
+    statement commits on its own.
+    """
+    conn.execute("DROP TABLE IF EXISTS cell_counts;")
+    conn.execute("DROP TABLE IF EXISTS cell_counts_meta;")
+    conn.execute("DROP TABLE IF EXISTS b_cell_buckets;")
+    conn.execute(SCHEMA_SQL)
+    conn.execute(META_SCHEMA_SQL)
+    conn.execute(BUCKETS_SCHEMA_SQL)
 
 
 def load_csv_into_db(conn: sqlite3.Connection, csv_path: Path) -> None:
+    """Append the CSV's rows to cell_counts. The caller commits."""
     if not csv_path.exists():
         raise FileNotFoundError(f"CSV file not found at {csv_path}")
 
-    with csv_path.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        rows = [
-            (
-                row["project"],
-                row["subject"],
-                row["condition"],
-                int(row["age"]),
-                row["sex"],
-                row["treatment"],
-                row.get("response") or None,
-                row["sample"],
-                row["sample_type"],
-                int(row["time_from_treatment_start"]),
-                int(row["b_cell"]),
-                int(row["cd8_t_cell"]),
-                int(row["cd4_t_cell"]),
-                int(row["nk_cell"]),
-                int(row["monocyte"]),
-            )
-            for row in reader
-        ]
-
-    with conn:
-        conn.executemany(
-            """
-            INSERT INTO cell_counts (
-                project,
-                subject,
-                condition,
-                age,
-                sex,
-                treatment,
-                response,
-                sample,
-                sample_type,
-                time_from_treatment_start,
-                b_cell,
-                cd8_t_cell,
-                cd4_t_cell,
-                nk_cell,
-                monocyte
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """,
-            rows,
+    df = pd.read_csv(
+        csv_path,
+        engine=CSV_ENGINE,
+        dtype={
+            "age": "int64",
+            "time_from_treatment_start": "int64",
+            "b_cell": "int64",
+            "cd8_t_cell": "int64",
+            "cd4_t_cell": "int64",
+            "nk_cell": "int64",
+            "monocyte": "int64",
+        },
+        keep_default_na=True,
+    )
+    # Missing responses are stored as NULL rather than NaN
+    df["response"] = df["response"].astype(object).where(df["response"].notna(), None)
+
+    # tolist() converts each column to native Python values in one C loop,
+    # so rows are zipped together without per-cell conversion
+    conn.executemany(
+        INSERT_SQL,
+        zip(*(df[col].tolist() for col in INSERT_COLUMNS)),
+    )
+
+
+def refresh_derived_tables(conn: sqlite3.Connection) -> None:
+    """Recompute cell_counts_meta and b_cell_buckets from cell_counts."""
+    conn.create_aggregate("pack_uint32", 1, UInt32Packer)
+    conn.execute("DELETE FROM cell_counts_meta;")
+    for key, col in FILTER_META_COLUMNS.items():
+        values = conn.execute(
+            f"SELECT DISTINCT {col} FROM cell_counts WHERE {col} IS NOT NULL ORDER BY {col};"
+        ).fetchall()
+        conn.execute(
+            "INSERT INTO cell_counts_meta (key, value) VALUES (?, ?);",
+            (key, json.dumps([row[0] for row in values])),
         )
+    conn.execute("DELETE FROM b_cell_buckets;")
+    conn.execute(BUCKETS_INSERT_SQL)
+
+
+def rebuild_db(conn: sqlite3.Connection, csv_path: Path) -> None:
+    """Replace the database contents with the CSV in a single transaction,
+    so readers never see empty tables and a failed load changes nothing.
+    """
+    conn.executescript(BULK_LOAD_PRAGMAS)
+    conn.execute("BEGIN")
+    try:
+        init_db(conn)
+        load_csv_into_db(conn, csv_path)
+        refresh_derived_tables(conn)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
 
 
 def main() -> None:
@@ -101,8 +213,7 @@ def main() -> None:
 
     conn = get_connection(DB_PATH)
     try:
-        init_db(conn)
-        load_csv_into_db(conn, CSV_PATH)
+        rebuild_db(conn, CSV_PATH)
     finally:
         conn.close()
 